@@ -1,6 +1,7 @@
 import subprocess
 from pathlib import Path
 from shutil import which
+from typing import Optional
 
 
 def run_git_command(command):
@@ -17,8 +18,9 @@ def git_current_branch():
     return run_git_command(['git', 'symbolic-ref', 'HEAD', '--short'])
 
 
-def git_commit_hash(ref: str = 'HEAD'):
-    return run_git_command(['git', 'rev-parse', '--verify', ref])
+def git_commit_hash(ref: str = 'HEAD', repo_dir: Optional[Path] = None):
+    repo_args = ['-C', str(repo_dir)] if repo_dir is not None else []
+    return run_git_command(['git', *repo_args, 'rev-parse', '--verify', ref])
 
 
 def git_diff(file_a: Path, file_b: Path) -> int:
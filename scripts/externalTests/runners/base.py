@@ -23,14 +23,17 @@ import os
 import subprocess
 from abc import ABCMeta
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from dataclasses import field
 from pathlib import Path
 from shutil import rmtree
 from tempfile import mkdtemp
 from textwrap import dedent
+from typing import Dict
 from typing import List
-from typing import Set
+from typing import Optional
+from typing import Tuple
 
 from test_helpers import download_project
 from test_helpers import get_solc_short_version
@@ -52,15 +55,17 @@ class TestConfig:
     settings_presets: List[SettingsPreset] = field(default_factory=lambda: list(SettingsPreset))
     evm_version: str = field(default=CURRENT_EVM_VERSION)
 
-    def selected_presets(self) -> Set[SettingsPreset]:
-        return set(self.compile_only_presets + self.settings_presets)
+    def selected_presets(self) -> Tuple[SettingsPreset, ...]:
+        """Returns the selected presets without duplicates, in the order in which they are declared"""
+        selected = set(self.compile_only_presets + self.settings_presets)
+        return tuple(preset for preset in SettingsPreset if preset in selected)
 
 
 class BaseRunner(metaclass=ABCMeta):
     config: TestConfig
     solc_binary_type: str
     solc_binary_path: Path
-    presets: Set[SettingsPreset]
+    presets: Tuple[SettingsPreset, ...]
 
     def __init__(self, argv, config: TestConfig):
         args = parse_command_line(f"{config.name} external tests", argv)
@@ -68,62 +73,91 @@ class BaseRunner(metaclass=ABCMeta):
         self.solc_binary_type = args.solc_binary_type
         self.solc_binary_path = args.solc_binary_path
         self.presets = parse_custom_presets(args.selected_presets) if args.selected_presets else config.selected_presets()
-        self.env = os.environ.copy()
+        # Variables to set on top of the inherited environment when running project commands
+        self.extra_env: Dict[str, str] = {}
+        # TODO: PRESET_JOBS should be a command-line option
+        self.preset_jobs = int(os.environ.get("PRESET_JOBS", "1"))
+        if self.preset_jobs < 1:
+            raise RuntimeError(f"PRESET_JOBS must be a positive number, got: {self.preset_jobs}.")
         self.tmp_dir = mkdtemp(prefix=f"ext-test-{config.name}-")
         self.test_dir = Path(self.tmp_dir) / "ext"
 
+    def command_env(self, overrides: Optional[Dict[str, str]] = None) -> Optional[Dict[str, str]]:
+        """
+        Returns the environment for commands run on the project: the inherited one with extra_env and
+        the given overrides applied. Returns None when there is nothing to override so that the command
+        simply inherits the environment.
+        """
+        extra_env = {**self.extra_env, **(overrides or {})}
+        if len(extra_env) == 0:
+            return None
+        return {**os.environ, **extra_env}
+
+    def output_prefix(self, preset: SettingsPreset) -> Optional[str]:
+        """Returns the prefix that tells apart the output of concurrently running presets, if any"""
+        return preset.value if self.preset_jobs > 1 else None
+
     def setup_solc(self) -> str:
         if self.solc_binary_type == "solcjs":
             # TODO: add support to solc-js
             raise NotImplementedError()
         print("Setting up solc...")
-        solc_version_output = subprocess.check_output(
+        solc_version_output = subprocess.run(
             [self.solc_binary_path, "--version"],
-            shell=False,
-            encoding="utf-8"
-        ).split(":")[1]
-        return parse_solc_version(solc_version_output)
-
-    @staticmethod
-    def enter_test_dir(fn):
-        """Run a function inside the test directory"""
-
-        previous_dir = os.getcwd()
-        def f(self, *args, **kwargs):
-            try:
-                assert self.test_dir is not None
-                os.chdir(self.test_dir)
-                return fn(self, *args, **kwargs)
-            finally:
-                # Restore the previous directory after execute fn
-                os.chdir(previous_dir)
-        return f
+            capture_output=True,
+            encoding="utf-8",
+            check=True
+        ).stdout
+        version_lines = [line for line in solc_version_output.splitlines() if line.startswith("Version:")]
+        if len(version_lines) == 0:
+            raise RuntimeError(f"Solc version could not be found in: {solc_version_output}.")
+        return parse_solc_version(version_lines[-1])
 
     def setup_environment(self):
         """Configure the project build environment"""
         print("Configuring Runner building environment...")
         replace_version_pragmas(self.test_dir)
 
-    @enter_test_dir
     def clean(self):
         """Clean temporary directories"""
         rmtree(self.tmp_dir)
 
-    @enter_test_dir
     @abstractmethod
     def configure(self):
         raise NotImplementedError()
 
-    @enter_test_dir
     @abstractmethod
     def compile(self, preset: SettingsPreset):
         raise NotImplementedError()
 
-    @enter_test_dir
     @abstractmethod
-    def run_test(self):
+    def run_test(self, preset: SettingsPreset):
         raise NotImplementedError()
 
+def run_preset(runner: BaseRunner, solc_version: str, preset: SettingsPreset, compile_only: bool):
+    """Compile and test the project with a single settings preset"""
+    settings = settings_from_preset(preset, runner.config.evm_version)
+    print(dedent(f"""\
+        Running compile function...
+        -------------------------------------
+        Settings preset: {preset.value}
+        Settings: {settings}
+        EVM version: {runner.config.evm_version}
+        Compiler version: {get_solc_short_version(solc_version)}
+        Compiler version (full): {solc_version}
+        -------------------------------------
+    """), end="", flush=True)
+    try:
+        runner.compile(preset)
+        if compile_only:
+            print(f"Skipping test function for {preset.value}...\n", end="", flush=True)
+        else:
+            print(f"Running test function for {preset.value}...\n", end="", flush=True)
+            runner.run_test(preset)
+        # TODO: store_benchmark_report
+    except subprocess.CalledProcessError as error:
+        raise RuntimeError(f"Settings preset {preset.value} failed: {error}") from error
+
 def run_test(runner: BaseRunner):
     print(f"Testing {runner.config.name}...\n===========================")
     print(f"Selected settings presets: {' '.join(p.value for p in runner.presets)}")
@@ -147,25 +181,20 @@ def run_test(runner: BaseRunner):
         -------------------------------------
     """))
     runner.configure()
-    for preset in runner.presets:
-        print("Running compile function...")
-        settings = settings_from_preset(preset, runner.config.evm_version)
-        print(dedent(f"""\
-            -------------------------------------
-            Settings preset: {preset.value}
-            Settings: {settings}
-            EVM version: {runner.config.evm_version}
-            Compiler version: {get_solc_short_version(solc_version)}
-            Compiler version (full): {solc_version}
-            -------------------------------------
-        """))
-        runner.compile(preset)
-        # TODO: COMPILE_ONLY should be a command-line option
-        if os.environ.get("COMPILE_ONLY") == "1" or preset in runner.config.compile_only_presets:
-            print("Skipping test function...")
-        else:
-            print("Running test function...")
-            runner.run_test()
-        # TODO: store_benchmark_report
+
+    # TODO: COMPILE_ONLY should be a command-line option
+    compile_only = os.environ.get("COMPILE_ONLY") == "1"
+    compile_only_presets = frozenset(runner.config.compile_only_presets)
+    jobs = [(preset, compile_only or preset in compile_only_presets) for preset in runner.presets]
+
+    # Presets are independent from each other so with PRESET_JOBS > 1 they are compiled and tested concurrently.
+    # This is opt-in because forge is multi-threaded itself and CI machines may have only a few cores and little memory.
+    with ThreadPoolExecutor(max_workers=max(1, min(runner.preset_jobs, len(jobs)))) as executor:
+        futures = [
+            executor.submit(run_preset, runner, solc_version, preset, preset_compile_only)
+            for preset, preset_compile_only in jobs
+        ]
+        for future in futures:
+            future.result()
     runner.clean()
     print("Done.")
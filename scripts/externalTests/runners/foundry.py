@@ -22,20 +22,70 @@
 import os
 import re
 import subprocess
+from pathlib import Path
 from shutil import which
 from textwrap import dedent
+from typing import Dict
+from typing import List
 from typing import Optional
 
 from runners.base import BaseRunner
 from test_helpers import SettingsPreset
 from test_helpers import settings_from_preset
 
-def run_forge_command(command: str, env: Optional[dict] = None):
-    subprocess.run(
-        command.split(),
-        env=env if env is not None else os.environ.copy(),
-        check=True
-    )
+PROFILE_NAME_REGEX = re.compile(r"[-+]+")
+PROFILE_TEMPLATE = dedent("""\
+    [profile.{name}]
+    gas_reports = ["*"]
+    auto_detect_solc = false
+    solc = "{solc}"
+    evm_version = "{evm_version}"
+    optimizer = {optimizer}
+    via_ir = {via_ir}
+    {output_dirs}
+    [profile.{name}.optimizer_details]
+    yul = {yul}
+""")
+
+# Used only when presets run concurrently, so that their builds do not overwrite each other's artifacts
+PROFILE_OUTPUT_DIRS_TEMPLATE = dedent("""\
+    out = "out/{name}"
+    cache_path = "cache/{name}"
+""")
+
+FORGE = which("forge")
+if FORGE is None:
+    raise RuntimeError("Forge not found.")
+
+def run_forge_command(
+    args: List[str],
+    env: Optional[Dict[str, str]] = None,
+    cwd: Optional[Path] = None,
+    output_prefix: Optional[str] = None,
+):
+    """
+    Run forge. If output_prefix is given, its stdout and stderr are streamed line by line
+    with the prefix prepended, so that output of concurrently running commands can be told apart.
+    """
+    if output_prefix is None:
+        subprocess.run([FORGE, *args], env=env, cwd=cwd, check=True)
+        return
+
+    with subprocess.Popen(
+        [FORGE, *args],
+        env=env,
+        cwd=cwd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        encoding="utf-8",
+        errors="replace",
+    ) as process:
+        assert process.stdout is not None
+        for line in process.stdout:
+            # A single write per line keeps lines of concurrent commands from being spliced together
+            print(f"[{output_prefix}] {line.rstrip()}\n", end="", flush=True)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, process.args)
 
 
 class FoundryRunner(BaseRunner):
@@ -43,31 +93,19 @@ class FoundryRunner(BaseRunner):
 
     FOUNDRY_CONFIG_FILE = "foundry.toml"
 
-    def setup_environment(self):
-        super().setup_environment()
-        if which("forge") is None:
-            raise RuntimeError("Forge not found.")
-
     @staticmethod
     def profile_name(preset: SettingsPreset):
         """Returns foundry profile name"""
         # Replace - or + by underscore to avoid invalid toml syntax
-        return re.sub(r"(\-|\+)+", "_", preset.value)
+        return PROFILE_NAME_REGEX.sub("_", preset.value)
+
+    def profile_env(self, preset: SettingsPreset) -> Optional[Dict[str, str]]:
+        """Returns the command environment with the Foundry profile for the preset set"""
+        return self.command_env({"FOUNDRY_PROFILE": self.profile_name(preset)})
 
     @staticmethod
     def profile_section(profile_fields: dict) -> str:
-        return dedent("""\
-            [profile.{name}]
-            gas_reports = ["*"]
-            auto_detect_solc = false
-            solc = "{solc}"
-            evm_version = "{evm_version}"
-            optimizer = {optimizer}
-            via_ir = {via_ir}
-
-            [profile.{name}.optimizer_details]
-            yul = {yul}
-        """).format(**profile_fields)
+        return PROFILE_TEMPLATE.format(**profile_fields)
 
     def setup_presets_profiles(self):
         """Configure forge tests profiles"""
@@ -82,32 +120,33 @@ class FoundryRunner(BaseRunner):
                 "optimizer": str(settings["optimizer"]["enabled"]).lower(),
                 "via_ir": str(settings["viaIR"]).lower(),
                 "yul": str(settings["optimizer"]["details"]["yul"]).lower(),
+                "output_dirs": (
+                    PROFILE_OUTPUT_DIRS_TEMPLATE.format(name=self.profile_name(preset))
+                    if self.preset_jobs > 1 else ""
+                ),
             }))
 
-        with open(
-            file=self.test_dir / self.FOUNDRY_CONFIG_FILE,
-            mode="a",
-            encoding="utf-8",
-        ) as f:
-            for profile in profiles:
-                f.write(profile)
+        content = "".join(profiles).encode("utf-8")
+        fd = os.open(self.test_dir / self.FOUNDRY_CONFIG_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            # os.write() may write only part of the buffer so keep going until all of it is written
+            written = 0
+            while written < len(content):
+                written += os.write(fd, content[written:])
+        finally:
+            os.close(fd)
 
-    @BaseRunner.enter_test_dir
     def configure(self):
         """Install project dependencies"""
         self.setup_presets_profiles()
-        run_forge_command("forge install", self.env)
+        run_forge_command(["install"], self.command_env(), self.test_dir)
 
-    @BaseRunner.enter_test_dir
     def compile(self, preset: SettingsPreset):
         """Compile project"""
 
-        # Set the Foundry profile environment variable
-        self.env.update({"FOUNDRY_PROFILE": self.profile_name(preset)})
-        run_forge_command("forge build", self.env)
+        run_forge_command(["build"], self.profile_env(preset), self.test_dir, self.output_prefix(preset))
 
-    @BaseRunner.enter_test_dir
-    def run_test(self):
+    def run_test(self, preset: SettingsPreset):
         """Run project tests"""
 
-        run_forge_command("forge test --gas-report", self.env)
+        run_forge_command(["test", "--gas-report"], self.profile_env(preset), self.test_dir, self.output_prefix(preset))
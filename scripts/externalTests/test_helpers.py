@@ -24,10 +24,16 @@ import re
 import subprocess
 import sys
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
 from enum import Enum
+from functools import lru_cache
+from math import ceil
 from pathlib import Path
+from shutil import copymode
+from tempfile import mkstemp
 from typing import List
-from typing import Set
+from typing import Tuple
 
 # Our scripts/ is not a proper Python package so we need to modify PYTHONPATH to import from it
 # pragma pylint: disable=import-error,wrong-import-position
@@ -35,9 +41,21 @@ PROJECT_ROOT = Path(__file__).parents[2]
 sys.path.insert(0, f"{PROJECT_ROOT}/scripts/common")
 
 from git_helpers import git_commit_hash
+from git_helpers import run_git_command
 
 SOLC_FULL_VERSION_REGEX = re.compile(r"^[a-zA-Z: ]*(.*)$")
 SOLC_SHORT_VERSION_REGEX = re.compile(r"^([0-9.]+).*\+|\-$")
+# Number of repositories git is allowed to fetch concurrently
+GIT_FETCH_JOBS = 8
+GIT_COMMIT_HASH_REGEX = re.compile(r"^[0-9a-f]{40}$", re.IGNORECASE)
+GIT_ABBREVIATED_COMMIT_HASH_REGEX = re.compile(r"^[0-9a-f]{7,39}$", re.IGNORECASE)
+PRAGMA_SOLIDITY_REGEX = re.compile(r"pragma solidity [^;]+;")
+# Directories that never contain sources that need their pragmas replaced.
+# Git metadata can appear at any depth, Foundry build outputs only in the project root.
+IGNORED_SOURCE_DIRS = {".git"}
+FOUNDRY_OUTPUT_DIRS = {"out", "cache", "forge-cache"}
+# Number of sources each worker process rewrites at a time
+PRAGMA_REPLACEMENT_CHUNK_SIZE = 64
 
 
 class SettingsPreset(Enum):
@@ -58,18 +76,31 @@ def compiler_settings(evm_version: str, via_ir: bool = False, optimizer: bool =
 
 
 def settings_from_preset(preset: SettingsPreset, evm_version: str) -> dict:
-    return {
-        SettingsPreset.LEGACY_NO_OPTIMIZE:       compiler_settings(evm_version),
-        SettingsPreset.IR_NO_OPTIMIZE:           compiler_settings(evm_version, via_ir=True),
-        SettingsPreset.LEGACY_OPTIMIZE_EVM_ONLY: compiler_settings(evm_version, optimizer=True),
-        SettingsPreset.IR_OPTIMIZE_EVM_ONLY:     compiler_settings(evm_version, via_ir=True, optimizer=True),
-        SettingsPreset.LEGACY_OPTIMIZE_EVM_YUL:  compiler_settings(evm_version, optimizer=True, yul=True),
-        SettingsPreset.IR_OPTIMIZE_EVM_YUL:      compiler_settings(evm_version, via_ir=True, optimizer=True, yul=True),
-    }[preset]
+    """Returns the compiler settings for the preset. The caller owns the returned dict."""
+    # The cached settings are shared, so give each caller its own copy
+    return deepcopy(_cached_settings_from_preset(preset, evm_version))
+
 
+@lru_cache(maxsize=None)
+def _cached_settings_from_preset(preset: SettingsPreset, evm_version: str) -> dict:
+    if preset == SettingsPreset.LEGACY_NO_OPTIMIZE:
+        return compiler_settings(evm_version)
+    elif preset == SettingsPreset.IR_NO_OPTIMIZE:
+        return compiler_settings(evm_version, via_ir=True)
+    elif preset == SettingsPreset.LEGACY_OPTIMIZE_EVM_ONLY:
+        return compiler_settings(evm_version, optimizer=True)
+    elif preset == SettingsPreset.IR_OPTIMIZE_EVM_ONLY:
+        return compiler_settings(evm_version, via_ir=True, optimizer=True)
+    elif preset == SettingsPreset.LEGACY_OPTIMIZE_EVM_YUL:
+        return compiler_settings(evm_version, optimizer=True, yul=True)
+    elif preset == SettingsPreset.IR_OPTIMIZE_EVM_YUL:
+        return compiler_settings(evm_version, via_ir=True, optimizer=True, yul=True)
+    raise KeyError(preset)
 
-def parse_custom_presets(presets: List[str]) -> Set[SettingsPreset]:
-    return {SettingsPreset(p) for p in presets}
+
+def parse_custom_presets(presets: List[str]) -> Tuple[SettingsPreset, ...]:
+    selected = {SettingsPreset(p) for p in presets}
+    return tuple(p for p in SettingsPreset if p in selected)
 
 def parse_command_line(description: str, args: List[str]):
     arg_parser = ArgumentParser(description)
@@ -96,45 +127,96 @@ def parse_command_line(description: str, args: List[str]):
     return arg_parser.parse_args(args)
 
 
-def download_project(test_dir: Path, repo_url: str, ref: str = "<latest-release>"):
-    print(f"Cloning {repo_url}...")
-    # Clone the repo ignoring all blobs until needed by git.
-    # This allows access to commit history but with a fast initial clone
-    subprocess.run(["git", "clone", "--filter", "blob:none", repo_url, test_dir.resolve()], check=True)
-    if not test_dir.exists():
-        raise RuntimeError("Failed to clone the project.")
-    os.chdir(test_dir)
-
-    # If the ref is '<latest-release>' try to use the latest tag as ref
-    # NOTE: Sadly this will not work with monorepos and may not always
-    # return the latest tag.
+def latest_remote_tag(repo_url: str) -> str:
+    """Returns the highest version tag of a remote repository without cloning it"""
+    tags = run_git_command(["git", "ls-remote", "--tags", "--refs", "--sort", "-v:refname", repo_url]).split('\n')
+    if len(tags) == 0 or tags[0] == "":
+        raise RuntimeError("Failed to retrieve latest release tag.")
+    return tags[0].split("\t")[1].removeprefix("refs/tags/")
+
+
+def update_submodules(test_dir: Path):
+    """
+    Foundry dependencies are submodules, usually with nested ones of their own. Fetch them all
+    here, concurrently and without history, so that `forge install` does not have to fetch them one by one.
+    """
+    if (test_dir / ".gitmodules").exists():
+        subprocess.run(
+            [
+                "git", "-C", str(test_dir), "submodule", "update", "--init", "--recursive",
+                "--depth", "1", "--jobs", str(GIT_FETCH_JOBS),
+            ],
+            check=True
+        )
+
+
+def shallow_clone_project(test_dir: Path, repo_url: str, ref: str):
+    """Fetch only the snapshot of the project at the given ref, without its history"""
     if ref == "<latest-release>":
-        tags = subprocess.check_output(
-            ["git", "tag", "--sort", "-v:refname"],
-            encoding="ascii"
-        ).strip().split('\n')
-        if len(tags) == 0:
-            raise RuntimeError("Failed to retrieve latest release tag.")
-        ref = tags[0]
+        ref = latest_remote_tag(repo_url)
 
     print(f"Using ref: {ref}")
-    subprocess.run(["git", "checkout", ref], check=True)
+    if GIT_COMMIT_HASH_REGEX.match(ref):
+        # Commits cannot be passed to `git clone --branch` so fetch them into an empty repository
+        run_git_command(["git", "init", str(test_dir.resolve())])
+        run_git_command(["git", "-C", str(test_dir), "remote", "add", "origin", repo_url])
+        subprocess.run(["git", "-C", str(test_dir), "fetch", "--depth", "1", "origin", ref.lower()], check=True)
+        subprocess.run(["git", "-C", str(test_dir), "checkout", "FETCH_HEAD"], check=True)
+        update_submodules(test_dir)
+    else:
+        # Submodules are fetched as part of the clone, concurrently with each other
+        subprocess.run(
+            [
+                "git", "clone", "--depth", "1",
+                "--recurse-submodules", "--shallow-submodules", "--jobs", str(GIT_FETCH_JOBS),
+                "--branch", ref, repo_url, str(test_dir.resolve()),
+            ],
+            check=True
+        )
 
-    if (test_dir / ".gitmodules").exists():
-        subprocess.run(["git", "submodule", "update", "--init"], check=True)
 
-    print(f"Current commit hash: {git_commit_hash()}")
+def download_project(test_dir: Path, repo_url: str, ref: str = "<latest-release>"):
+    # NOTE: Commands that talk to the remote or check out files are run with subprocess.run() rather than
+    # run_git_command() so that their progress and error messages end up in the CI log instead of being captured.
+    print(f"Cloning {repo_url}...")
+    # Remotes only serve commits by their full hash, so an abbreviated one can only be
+    # resolved in a clone that has the whole history.
+    if os.environ.get("GIT_PARTIAL_CLONE") == "1" and not GIT_ABBREVIATED_COMMIT_HASH_REGEX.match(ref):
+        shallow_clone_project(test_dir, repo_url, ref)
+        if not test_dir.exists():
+            raise RuntimeError("Failed to clone the project.")
+    else:
+        # Clone the repo ignoring all blobs until needed by git.
+        # This allows access to commit history but with a fast initial clone
+        subprocess.run(["git", "clone", "--filter", "blob:none", repo_url, str(test_dir.resolve())], check=True)
+        if not test_dir.exists():
+            raise RuntimeError("Failed to clone the project.")
+
+        # If the ref is '<latest-release>' try to use the latest tag as ref
+        # NOTE: Sadly this will not work with monorepos and may not always
+        # return the latest tag.
+        if ref == "<latest-release>":
+            tags = run_git_command(["git", "-C", str(test_dir), "tag", "--sort", "-v:refname"]).split('\n')
+            if len(tags) == 0:
+                raise RuntimeError("Failed to retrieve latest release tag.")
+            ref = tags[0]
+
+        print(f"Using ref: {ref}")
+        subprocess.run(["git", "-C", str(test_dir), "checkout", ref], check=True)
+        update_submodules(test_dir)
+
+    print(f"Current commit hash: {git_commit_hash(repo_dir=test_dir)}")
 
 
 def parse_solc_version(solc_version_string: str) -> str:
-    solc_version_match = re.search(SOLC_FULL_VERSION_REGEX, solc_version_string)
+    solc_version_match = SOLC_FULL_VERSION_REGEX.search(solc_version_string)
     if solc_version_match is None:
         raise RuntimeError(f"Solc version could not be found in: {solc_version_string}.")
     return solc_version_match.group(1)
 
 
 def get_solc_short_version(solc_full_version: str) -> str:
-    solc_short_version_match = re.search(SOLC_SHORT_VERSION_REGEX, solc_full_version)
+    solc_short_version_match = SOLC_SHORT_VERSION_REGEX.search(solc_full_version)
     if solc_short_version_match is None:
         raise RuntimeError(f"Error extracting short version string from: {solc_full_version}.")
     return solc_short_version_match.group(1)
@@ -144,14 +226,72 @@ def store_benchmark_report(self):
     raise NotImplementedError()
 
 
+def find_solidity_sources(root_dir: Path) -> List[Path]:
+    """
+    Recursively collect all .sol files in the directory, skipping git metadata and
+    the Foundry build outputs in the root directory.
+    Dependencies in node_modules are only skipped if SKIP_VENDOR_PRAGMAS=1 is set.
+    """
+    ignored_dirs = IGNORED_SOURCE_DIRS
+    if os.environ.get("SKIP_VENDOR_PRAGMAS") == "1":
+        ignored_dirs = ignored_dirs | {"node_modules"}
+
+    sources = []
+    pending_dirs = [str(root_dir)]
+    while len(pending_dirs) > 0:
+        current_dir = pending_dirs.pop()
+        ignored_subdirs = (ignored_dirs | FOUNDRY_OUTPUT_DIRS) if current_dir == str(root_dir) else ignored_dirs
+        with os.scandir(current_dir) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in ignored_subdirs:
+                        pending_dirs.append(entry.path)
+                elif entry.name.endswith(".sol") and entry.is_file():
+                    sources.append(Path(entry.path))
+    return sources
+
+
+def replace_version_pragma(source: Path):
+    """Replace fixed-version pragmas in a single source file, leaving it untouched if nothing changed"""
+    # Rewrite the target of a symlink rather than replacing the link itself with a regular file
+    source = source.resolve()
+    original = source.read_bytes()
+    # Cheap check to skip the regex and the write for files without any pragma
+    if b"pragma solidity" not in original:
+        return
+
+    content = PRAGMA_SOLIDITY_REGEX.sub("pragma solidity >=0.0;", original.decode("utf-8")).encode("utf-8")
+    if content == original:
+        return
+
+    # Write to a temporary file first so that an interrupted run never leaves a truncated source behind
+    fd, tmp_path = mkstemp(dir=source.parent, prefix=f".{source.name}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        copymode(source, tmp_path)
+        os.replace(tmp_path, source)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
 def replace_version_pragmas(test_dir: Path):
     """
     Replace fixed-version pragmas (part of Consensys best practice).
     Include all directories to also cover node dependencies.
     """
     print("Replacing fixed-version pragmas...")
-    for source in test_dir.glob("**/*.sol"):
-        content = source.read_text(encoding="utf-8")
-        content = re.sub(r"pragma solidity [^;]+;", r"pragma solidity >=0.0;", content)
-        with open(source, "w", encoding="utf-8") as f:
-            f.write(content)
+    sources = find_solidity_sources(test_dir)
+    if len(sources) <= PRAGMA_REPLACEMENT_CHUNK_SIZE:
+        # Not worth starting worker processes for a single chunk
+        for source in sources:
+            replace_version_pragma(source)
+        return
+
+    # Start no more workers than there are chunks to process. NOTE: os.cpu_count() is the host's
+    # core count inside containers, so it alone may be much more than what is actually available.
+    max_workers = min(os.cpu_count() or 1, ceil(len(sources) / PRAGMA_REPLACEMENT_CHUNK_SIZE))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # Consume the results to propagate exceptions raised by the workers
+        list(executor.map(replace_version_pragma, sources, chunksize=PRAGMA_REPLACEMENT_CHUNK_SIZE))
@@ -44,7 +44,8 @@ class PRBMathRunner(FoundryRunner):
         # has transitioned from Foundry to Node.js.
         subprocess.run(
             ["pnpm", "install", "--no-frozen-lockfile"],
-            env=self.env,
+            env=self.command_env(),
+            cwd=self.test_dir,
             check=True
         )
 
@@ -65,4 +66,5 @@ test_config = TestConfig(
     ],
 )
 
-sys.exit(run_test(PRBMathRunner(argv=sys.argv[1:], config=test_config)))
+if __name__ == "__main__":
+    sys.exit(run_test(PRBMathRunner(argv=sys.argv[1:], config=test_config)))
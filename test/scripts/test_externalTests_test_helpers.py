@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+import os
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+# NOTE: This test file file only works with scripts/ added to PYTHONPATH so pylint can't find the imports
+# pragma pylint: disable=import-error
+from externalTests.test_helpers import download_project, find_solidity_sources, replace_version_pragma
+# pragma pylint: enable=import-error
+
+
+class TestFindSoliditySources(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.root = Path(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def create_files(self, *relative_paths: str):
+        for relative_path in relative_paths:
+            path = self.root / relative_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text("pragma solidity =0.8.0;\n", encoding="utf-8")
+
+    def found_sources(self) -> set:
+        return {path.relative_to(self.root).as_posix() for path in find_solidity_sources(self.root)}
+
+    def test_finds_sources_in_nested_directories(self):
+        self.create_files("A.sol", "src/B.sol", "lib/dep/src/C.sol", "src/README.md", "src/D.sol.txt")
+
+        self.assertEqual(self.found_sources(), {"A.sol", "src/B.sol", "lib/dep/src/C.sol"})
+
+    def test_skips_git_directories_at_any_depth(self):
+        self.create_files("A.sol", ".git/B.sol", "lib/dep/.git/C.sol")
+
+        self.assertEqual(self.found_sources(), {"A.sol"})
+
+    def test_skips_foundry_outputs_only_in_root(self):
+        self.create_files(
+            "out/A.sol",
+            "cache/B.sol",
+            "forge-cache/C.sol",
+            "src/cache/D.sol",
+            "lib/dep/out/E.sol",
+            "lib/forge-cache/F.sol",
+        )
+
+        self.assertEqual(self.found_sources(), {"src/cache/D.sol", "lib/dep/out/E.sol", "lib/forge-cache/F.sol"})
+
+    def test_node_modules(self):
+        self.create_files("A.sol", "node_modules/dep/B.sol", "lib/node_modules/C.sol")
+
+        with patch.dict(os.environ, {"SKIP_VENDOR_PRAGMAS": "0"}):
+            self.assertEqual(self.found_sources(), {"A.sol", "node_modules/dep/B.sol", "lib/node_modules/C.sol"})
+        with patch.dict(os.environ, {"SKIP_VENDOR_PRAGMAS": "1"}):
+            self.assertEqual(self.found_sources(), {"A.sol"})
+
+
+class TestDownloadProject(unittest.TestCase):
+    REPO_URL = "https://github.com/example/project.git"
+    COMMIT_HASH = "0123456789abcdef0123456789abcdef01234567"
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()  # pylint: disable=consider-using-with
+        # The clone is mocked so use a directory that already exists
+        self.test_dir = Path(self.tmp_dir.name).resolve()
+        self.commands = []
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def subprocess_run_mock(self, command, **_kwargs):
+        self.commands.append(command)
+
+    def run_git_command_mock(self, command):
+        self.commands.append(command)
+        if "ls-remote" in command:
+            return f"{self.COMMIT_HASH}\trefs/tags/v2.0.0\n{self.COMMIT_HASH}\trefs/tags/v1.0.0"
+        if "tag" in command:
+            return "v2.0.0\nv1.0.0"
+        return ""
+
+    def download(self, ref: str, partial_clone: bool) -> list:
+        with patch.dict(os.environ, {"GIT_PARTIAL_CLONE": "1" if partial_clone else "0"}), \
+            patch("externalTests.test_helpers.subprocess.run", self.subprocess_run_mock), \
+            patch("externalTests.test_helpers.run_git_command", self.run_git_command_mock), \
+            patch("externalTests.test_helpers.git_commit_hash", return_value=self.COMMIT_HASH), \
+            patch("builtins.print"):
+            download_project(self.test_dir, self.REPO_URL, ref)
+        return self.commands
+
+    def full_clone_commands(self, checkout_ref: str) -> list:
+        return [
+            ["git", "clone", "--filter", "blob:none", self.REPO_URL, str(self.test_dir)],
+            ["git", "-C", str(self.test_dir), "checkout", checkout_ref],
+        ]
+
+    def shallow_clone_commands(self, branch: str) -> list:
+        return [[
+            "git", "clone", "--depth", "1",
+            "--recurse-submodules", "--shallow-submodules", "--jobs", "8",
+            "--branch", branch, self.REPO_URL, str(self.test_dir),
+        ]]
+
+    def commit_fetch_commands(self, commit_hash: str) -> list:
+        return [
+            ["git", "init", str(self.test_dir)],
+            ["git", "-C", str(self.test_dir), "remote", "add", "origin", self.REPO_URL],
+            ["git", "-C", str(self.test_dir), "fetch", "--depth", "1", "origin", commit_hash],
+            ["git", "-C", str(self.test_dir), "checkout", "FETCH_HEAD"],
+        ]
+
+    def test_full_clone(self):
+        for ref in [self.COMMIT_HASH, self.COMMIT_HASH.upper(), self.COMMIT_HASH[:8], "v1.0.0"]:
+            with self.subTest(ref=ref):
+                self.commands = []
+                self.assertEqual(self.download(ref, partial_clone=False), self.full_clone_commands(ref))
+
+    def test_full_clone_latest_release(self):
+        self.assertEqual(
+            self.download("<latest-release>", partial_clone=False),
+            [
+                self.full_clone_commands("v2.0.0")[0],
+                ["git", "-C", str(self.test_dir), "tag", "--sort", "-v:refname"],
+                self.full_clone_commands("v2.0.0")[1],
+            ]
+        )
+
+    def test_partial_clone_full_commit_hash(self):
+        self.assertEqual(self.download(self.COMMIT_HASH, partial_clone=True), self.commit_fetch_commands(self.COMMIT_HASH))
+
+    def test_partial_clone_uppercase_commit_hash(self):
+        self.assertEqual(
+            self.download(self.COMMIT_HASH.upper(), partial_clone=True),
+            self.commit_fetch_commands(self.COMMIT_HASH)
+        )
+
+    def test_partial_clone_abbreviated_commit_hash_falls_back_to_full_clone(self):
+        self.assertEqual(
+            self.download(self.COMMIT_HASH[:8], partial_clone=True),
+            self.full_clone_commands(self.COMMIT_HASH[:8])
+        )
+
+    def test_partial_clone_tag(self):
+        self.assertEqual(self.download("v1.0.0", partial_clone=True), self.shallow_clone_commands("v1.0.0"))
+
+    def test_partial_clone_latest_release(self):
+        self.assertEqual(
+            self.download("<latest-release>", partial_clone=True),
+            [
+                ["git", "ls-remote", "--tags", "--refs", "--sort", "-v:refname", self.REPO_URL],
+                *self.shallow_clone_commands("v2.0.0"),
+            ]
+        )
+
+
+class TestReplaceVersionPragma(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.source = Path(self.tmp_dir.name) / "A.sol"
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_replaces_all_pragmas(self):
+        self.source.write_bytes(b"pragma solidity =0.8.0;\r\ncontract A {}\r\npragma solidity ^0.7.0 || ^0.8.0;\r\n")
+
+        replace_version_pragma(self.source)
+
+        self.assertEqual(
+            self.source.read_bytes(),
+            b"pragma solidity >=0.0;\r\ncontract A {}\r\npragma solidity >=0.0;\r\n"
+        )
+
+    def test_preserves_file_mode(self):
+        self.source.write_text("pragma solidity 0.8.0;\n", encoding="utf-8")
+        self.source.chmod(0o755)
+
+        replace_version_pragma(self.source)
+
+        self.assertEqual(self.source.read_text(encoding="utf-8"), "pragma solidity >=0.0;\n")
+        self.assertEqual(self.source.stat().st_mode & 0o777, 0o755)
+
+    def test_does_not_rewrite_files_without_changes(self):
+        for content in ["contract A {}\n", "pragma solidity >=0.0;\ncontract A {}\n"]:
+            self.source.write_text(content, encoding="utf-8")
+            os.utime(self.source, ns=(0, 0))
+
+            replace_version_pragma(self.source)
+
+            self.assertEqual(self.source.read_text(encoding="utf-8"), content)
+            self.assertEqual(self.source.stat().st_mtime_ns, 0)
+
+    def test_writes_through_symlinks(self):
+        target = Path(self.tmp_dir.name) / "shared" / "S.sol"
+        target.parent.mkdir()
+        target.write_text("pragma solidity =0.8.0;\n", encoding="utf-8")
+        self.source.symlink_to(Path("shared") / "S.sol")
+
+        replace_version_pragma(self.source)
+
+        self.assertTrue(self.source.is_symlink())
+        self.assertEqual(target.read_text(encoding="utf-8"), "pragma solidity >=0.0;\n")
+        self.assertEqual(sorted(path.name for path in target.parent.iterdir()), ["S.sol"])
+
+    def test_leaves_no_temporary_files(self):
+        self.source.write_text("pragma solidity 0.8.0;\n", encoding="utf-8")
+
+        replace_version_pragma(self.source)
+
+        self.assertEqual([path.name for path in self.source.parent.iterdir()], ["A.sol"])